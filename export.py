@@ -0,0 +1,43 @@
+import os
+import argparse
+from ctranslate2.converters import TransformersConverter
+from model_server import MODEL_DIR, select_device
+
+# Offline step: convert the Hugging Face Whisper checkpoint into a CTranslate2
+# model already stored in the compute type this machine will run, so the model
+# server loads it as-is instead of downloading float16 weights and quantizing
+# them on every start. Needs `pip install transformers` (conversion only).
+
+DEFAULT_MODEL = "openai/whisper-small"
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+
+def main():
+    _, compute_type = select_device()
+    parser = argparse.ArgumentParser(description="Export Whisper for the model server")
+    parser.add_argument("--model", default=DEFAULT_MODEL,
+                        help="Hugging Face model ID or local checkpoint")
+    parser.add_argument("--quantization", default=compute_type,
+                        help=f"CTranslate2 weight type (default for this machine: {compute_type})")
+    parser.add_argument("--output",
+                        help="Output directory (default: the server's model directory for "
+                             "the default model, else models/<model name>)")
+    args = parser.parse_args()
+    if not args.output:
+        if args.model == DEFAULT_MODEL:
+            args.output = MODEL_DIR
+        else:
+            args.output = os.path.join(MODELS_DIR, os.path.basename(os.path.normpath(args.model)))
+
+    converter = TransformersConverter(
+        args.model, copy_files=["tokenizer.json", "preprocessor_config.json"]
+    )
+    converter.convert(args.output, quantization=args.quantization, force=True)
+    print(f"Exported {args.model} ({args.quantization}) to {args.output}")
+    if os.path.abspath(args.output) != os.path.abspath(MODEL_DIR):
+        print(f"Set TRANSCRIBE_MODEL_DIR={args.output} for the model server to load it.")
+    print("Restart the model server (or wait for it to go idle) to pick it up.")
+
+
+if __name__ == "__main__":
+    main()
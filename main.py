@@ -1,38 +1,182 @@
 import sys
 import os
-import whisper
-import multiprocessing
-from pydub import AudioSegment
+import time
+import queue
+import bisect
+import functools
+import soundfile
+import miniaudio
 import simpleaudio as sa
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QListWidget, QLabel, QFileDialog, QMessageBox
 )
-from PySide6.QtCore import QThread, Signal, QTimer
+from PySide6.QtCore import Qt, QThread, Signal, QTimer
 from deep_translator import GoogleTranslator
+import server_client
 
-# Ensure safe multiprocessing start method on macOS
-multiprocessing.set_start_method('spawn', force=True)
+# Greedy first pass shown right away, then an optional beam-search pass that
+# replaces it once complete (TRANSCRIBE_REFINE=0 keeps the preview only)
+PREVIEW_OPTIONS = {'beam_size': 1, 'temperature': 0.0}
+FINAL_OPTIONS = {'beam_size': 5}
+REFINE_TRANSCRIPTION = os.environ.get("TRANSCRIBE_REFINE", "1") != "0"
+
+# Translation requests are grouped per GUI update: up to this many sentences,
+# or whatever arrived within this many seconds
+TRANSLATE_BATCH_SIZE = 16
+TRANSLATE_BATCH_WAIT = 0.2
+
+# Playback decodes at most this much audio per simpleaudio buffer
+PLAYBACK_CHUNK_SECONDS = 60
+
+
+@functools.lru_cache(maxsize=4096)
+def translate_text(text):
+    # Short phrases (greetings, fillers) repeat within and across files;
+    # failed requests raise and are therefore not cached. GoogleTranslator keeps
+    # per-request state on the instance, so each call gets its own.
+    return GoogleTranslator(source='ja', target='vi').translate(text)
+
+
+class ModelLoadWorker(QThread):
+    finished = Signal(object)
+    error = Signal(str)
+
+    def run(self):
+        try:
+            # Starts the model server if needed and waits until its model is warm
+            conn = server_client.connect()
+            try:
+                list(server_client.request(conn, "hello"))
+            except Exception:
+                conn.close()
+                raise
+            # Handed to the window, which keeps it open so the server counts it
+            # as a client and does not shut down while the window is open
+            self.finished.emit(conn)
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class DecodeWorker(QThread):
+    error = Signal(str)
+
+    def __init__(self, audio_path, parent=None):
+        super().__init__(parent)
+        self.audio_path = audio_path
+
+    def run(self):
+        try:
+            # Server decodes and VAD-trims the file now so Transcribe finds it cached
+            conn = server_client.connect()
+            with conn:
+                list(server_client.request(conn, "prepare", self.audio_path))
+        except Exception as e:
+            self.error.emit(str(e))
 
 
 class TranscribeWorker(QThread):
-    finished = Signal(list)
+    segment = Signal(dict)
+    done = Signal()
+    refined = Signal(list)
     error = Signal(str)
 
-    def __init__(self, model, audio_path):
+    def __init__(self, audio_path, texts, refine=REFINE_TRANSCRIPTION,
+                 batch_size=server_client.BATCH_SIZE):
         super().__init__()
-        self.model = model
         self.audio_path = audio_path
+        self.texts = texts  # TranslateWorker queue, fed while transcribing
+        self.refine = refine
+        self.batch_size = batch_size
+        self.cancelled = False
+
+    def cancel(self):
+        # Checked while waiting on the server; the worker then disconnects, which
+        # frees the model for the next transcription
+        self.cancelled = True
+
+    def is_cancelled(self):
+        return self.cancelled
 
     def run(self):
         try:
-            result = self.model.transcribe(
-                self.audio_path, language="ja", word_timestamps=True
-            )
-            segments = result.get("segments", [])
-            self.finished.emit(segments)
+            conn = server_client.connect()
         except Exception as e:
+            self.texts.put(None)
             self.error.emit(str(e))
+            return
+        try:
+            with conn:
+                # Greedy preview; segments are streamed back as the server decodes them
+                options = dict(PREVIEW_OPTIONS, batch_size=self.batch_size)
+                try:
+                    for seg in server_client.request(conn, "transcribe", self.audio_path, options,
+                                                     cancelled=self.is_cancelled):
+                        if not seg['text'].strip():
+                            continue
+                        self.texts.put(seg['text'])
+                        self.segment.emit(seg)
+                finally:
+                    # Let the translator finish once the preview is complete
+                    self.texts.put(None)
+                self.done.emit()
+
+                if self.refine:
+                    # Beam search in the background, swapped in as a whole when done
+                    options = dict(FINAL_OPTIONS, batch_size=self.batch_size)
+                    segments = server_client.request(conn, "transcribe", self.audio_path, options,
+                                                     cancelled=self.is_cancelled)
+                    self.refined.emit([seg for seg in segments if seg['text'].strip()])
+        except server_client.Cancelled:
+            pass
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class TranslateWorker(QThread):
+    translated = Signal(list)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Japanese sentences in list order; None marks the end of the pass
+        self.queue = queue.Queue()
+        self.cancelled = False
+
+    def cancel(self):
+        # Stop after the sentence being translated; anything still queued is dropped
+        self.cancelled = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(None)
+
+    def run(self):
+        finished = False
+        while not finished and not self.cancelled:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + TRANSLATE_BATCH_WAIT
+            while batch[-1] is not None and len(batch) < TRANSLATE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            finished = batch[-1] is None
+            translated = []
+            for text in batch:
+                if self.cancelled:
+                    return
+                if text is not None:
+                    translated.append(self.translate(text))
+            if translated:
+                self.translated.emit(translated)
+
+    def translate(self, text):
+        try:
+            return translate_text(text)
+        except Exception:
+            return ""
 
 
 class AudioTranscriber(QWidget):
@@ -81,28 +225,47 @@ class AudioTranscriber(QWidget):
 
         # --- Internal state ---
         self.audio_path = None
-        self.audio_segment = None
+        self.sound_file = None
+        self.mp3_info = None  # miniaudio fallback for mp3s libsndfile can't open
+        self.audio_duration_ms = 0
         self.play_obj = None
+        self.chunk_end_ms = 0
         self.segments = []
+        self.segment_starts = []  # sorted, parallel to self.segments for bisect
+        self.segment_ends = []
         self.worker = None
+        self.decode_worker = None
+        self.translate_worker = None
+        self.workers = set()  # every running worker thread, for closeEvent
         self.current_playback_start = 0  # in milliseconds
         self.user_clicked_sentence = False
 
+        # Streamed segments are added to the list in bursts, not one by one
+        self.pending_rows = []
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(50)
+        self.flush_timer.timeout.connect(self.flush_segments)
+
         self.update_timer = QTimer()
         self.update_timer.setInterval(100)
         self.update_timer.timeout.connect(self.update_current_sentence)
 
-        # Load Whisper model
-        QApplication.processEvents()
-        try:
-            self.model = whisper.load_model("small")
-            self.status_label.setText("Whisper model loaded.")
-        except Exception as e:
-            self.status_label.setText(f"Error loading model: {e}")
-            self.model = None
+        # Load and warm up the Whisper model in the model server
+        self.model_ready = False
+        self.server_conn = None
+        self.model_worker = ModelLoadWorker()
+        self.model_worker.finished.connect(self.on_model_loaded)
+        self.model_worker.error.connect(self.on_model_error)
+        self.model_worker.start()
+
+    def on_model_loaded(self, conn):
+        self.server_conn = conn
+        self.model_ready = True
+        self.status_label.setText("Whisper model loaded.")
 
-        # Translator
-        self.translator = GoogleTranslator(source='ja', target='vi')
+    def on_model_error(self, message):
+        self.status_label.setText(f"Error loading model: {message}")
 
     # --- Audio load ---
     def load_audio(self):
@@ -111,64 +274,204 @@ class AudioTranscriber(QWidget):
         )
         if file_name:
             try:
+                self.stop_audio()
+                self.cancel_transcription()
+                self.close_audio()
+                try:
+                    # Keep only a file handle; playback seeks and decodes on demand
+                    self.sound_file = soundfile.SoundFile(file_name)
+                    self.audio_duration_ms = int(
+                        self.sound_file.frames * 1000 / self.sound_file.samplerate
+                    )
+                except RuntimeError:
+                    # libsndfile < 1.1 can't decode mp3; miniaudio also seeks and decodes on demand
+                    self.mp3_info = miniaudio.mp3_get_file_info(file_name)
+                    self.audio_duration_ms = int(self.mp3_info.duration * 1000)
                 self.audio_path = file_name
-                self.audio_segment = AudioSegment.from_file(file_name)
+                self.current_playback_start = 0
                 self.status_label.setText(f"Loaded: {os.path.basename(file_name)}")
+
+                # Decode for Whisper in the background so Transcribe skips ffmpeg
+                # (parented so a still-running decode survives loading another file)
+                self.decode_worker = DecodeWorker(file_name, self)
+                self.decode_worker.error.connect(self.on_decode_error)
+                self.start_worker(self.decode_worker)
             except Exception as e:
                 self.status_label.setText(f"Error loading audio: {e}")
 
+    def on_decode_error(self, message):
+        self.status_label.setText(f"Error decoding audio: {message}")
+
+    def close_audio(self):
+        if self.sound_file:
+            self.sound_file.close()
+        self.sound_file = None
+        self.mp3_info = None
+        self.audio_path = None
+        self.audio_duration_ms = 0
+
     # --- Transcription ---
     def transcribe_audio(self):
-        if not self.audio_path or not self.model:
+        if not self.audio_path or not self.model_ready:
             self.status_label.setText("Audio or model not loaded.")
             return
-
+        # Starting over cuts a running preview or refine pass short
+        self.cancel_transcription()
+        self.clear_transcription()
         self.status_label.setText("Transcribing...")
         QApplication.processEvents()
 
-        self.worker = TranscribeWorker(self.model, self.audio_path)
-        self.worker.finished.connect(self.on_transcription_done)
+        # Translation consumes sentences while Whisper is still producing them
+        texts = self.start_translation()
+        self.worker = TranscribeWorker(self.audio_path, texts)
+        self.worker.segment.connect(self.on_segment)
+        self.worker.done.connect(self.on_transcription_done)
+        self.worker.refined.connect(self.on_transcription_refined)
         self.worker.error.connect(self.on_transcription_error)
-        self.worker.start()
+        self.start_worker(self.worker)
 
-    def on_transcription_done(self, segments):
+    def cancel_transcription(self):
+        if self.worker:
+            self.worker.cancel()
+        self.worker = None
+
+    def is_current(self, worker):
+        # Signals already queued by a cancelled worker, or one for another file
+        return worker is self.worker and worker.audio_path == self.audio_path
+
+    def clear_transcription(self):
         self.segments = []
+        self.segment_starts = []
+        self.segment_ends = []
+        if self.translate_worker:
+            self.translate_worker.cancel()
+        self.translate_worker = None
+        self.pending_rows = []
+        self.flush_timer.stop()
         self.ja_list.clear()
         self.vi_list.clear()
 
-        for seg in segments:
-            if not seg['text'].strip():
-                continue
-            self.segments.append(seg)
-            # Japanese with timestamps
-            self.ja_list.addItem(f"{seg['text']} ({seg['start']:.2f}-{seg['end']:.2f})")
-            # Vietnamese translation
-            try:
-                viet = self.translator.translate(seg['text'])
-            except Exception:
-                viet = ""
-            self.vi_list.addItem(viet)
+    def on_segment(self, seg):
+        if self.is_current(self.sender()):
+            self.add_segment(seg)
+
+    def add_segment(self, seg):
+        # Segments arrive in time order, so appending keeps the starts sorted
+        self.segments.append(seg)
+        self.segment_starts.append(seg['start'])
+        self.segment_ends.append(seg['end'])
+        # Japanese with timestamps
+        self.pending_rows.append(f"{seg['text']} ({seg['start']:.2f}-{seg['end']:.2f})")
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush_segments(self):
+        self.flush_timer.stop()
+        if not self.pending_rows:
+            return
+        # Each item remembers its segment index
+        self.add_list_items(self.ja_list, self.pending_rows, with_index=True)
+        self.pending_rows = []
+        self.status_label.setText(f"Transcribing... {len(self.segments)} segments")
+
+    def add_list_items(self, list_widget, texts, with_index=False):
+        # One insert and one layout pass for the whole batch instead of one per item
+        first = list_widget.count()
+        list_widget.setUpdatesEnabled(False)
+        list_widget.blockSignals(True)
+        list_widget.addItems(texts)
+        if with_index:
+            # The rows are brand new and repainted below, so their per-item
+            # dataChanged notifications can be skipped too
+            model = list_widget.model()
+            model.blockSignals(True)
+            for i in range(first, list_widget.count()):
+                list_widget.item(i).setData(Qt.UserRole, i)
+            model.blockSignals(False)
+        list_widget.blockSignals(False)
+        list_widget.setUpdatesEnabled(True)
+
+    def on_transcription_done(self):
+        if not self.is_current(self.sender()):
+            return
+        self.flush_segments()
+        if self.worker.refine:
+            self.status_label.setText(
+                f"Preview done: {len(self.segments)} segments, refining..."
+            )
+        else:
+            self.status_label.setText(f"Transcription done: {len(self.segments)} segments")
 
+    def on_transcription_refined(self, segments):
+        if not self.is_current(self.sender()):
+            return
+        self.clear_transcription()
+        texts = self.start_translation()
+        for seg in segments:
+            self.add_segment(seg)
+            # Unchanged sentences come straight from the translation cache
+            texts.put(seg['text'])
+        texts.put(None)
+        self.flush_segments()
         self.status_label.setText(f"Transcription done: {len(self.segments)} segments")
 
+    def start_translation(self):
+        # Vietnamese translation, off the GUI thread; returns the queue feeding it
+        self.translate_worker = TranslateWorker(self)
+        self.translate_worker.translated.connect(self.on_translated)
+        self.start_worker(self.translate_worker)
+        return self.translate_worker.queue
+
+    def on_translated(self, texts):
+        # Drop results of a translation superseded by a newer transcription
+        if self.sender() is not self.translate_worker:
+            return
+        # Translations arrive in list order, so they extend the Vietnamese rows
+        self.add_list_items(self.vi_list, texts)
+
     def on_transcription_error(self, message):
+        if not self.is_current(self.sender()):
+            return
         self.status_label.setText(f"Transcription error: {message}")
 
     # --- Audio playback ---
+    def read_audio_chunk(self, start_ms):
+        # Returns (pcm, channels, sample_width, frame_rate) for up to PLAYBACK_CHUNK_SECONDS
+        if self.sound_file:
+            sf = self.sound_file
+            sf.seek(min(int(start_ms / 1000 * sf.samplerate), sf.frames))
+            pcm = sf.read(PLAYBACK_CHUNK_SECONDS * sf.samplerate, dtype='int16')
+            return pcm, sf.channels, 2, sf.samplerate
+        # Fallback: decode only the requested chunk of the mp3
+        info = self.mp3_info
+        frame = start_ms * info.sample_rate // 1000
+        if frame >= info.num_frames:
+            return b"", info.nchannels, 2, info.sample_rate
+        stream = miniaudio.mp3_stream_file(
+            self.audio_path, frames_to_read=PLAYBACK_CHUNK_SECONDS * info.sample_rate,
+            seek_frame=frame
+        )
+        pcm = next(stream, b"")
+        stream.close()
+        return pcm, info.nchannels, 2, info.sample_rate
+
     def play_audio(self, start_ms=None):
-        if not self.audio_segment:
+        if not self.audio_path:
             return
         if start_ms is None:
             start_ms = self.current_playback_start
         try:
-            segment_to_play = self.audio_segment[start_ms:]
+            pcm, channels, sample_width, frame_rate = self.read_audio_chunk(start_ms)
+            if not len(pcm):
+                return
             self.play_obj = sa.play_buffer(
-                segment_to_play.raw_data,
-                num_channels=segment_to_play.channels,
-                bytes_per_sample=segment_to_play.sample_width,
-                sample_rate=segment_to_play.frame_rate
+                pcm,
+                num_channels=channels,
+                bytes_per_sample=sample_width,
+                sample_rate=frame_rate
             )
             self.current_playback_start = start_ms
+            self.chunk_end_ms = start_ms + PLAYBACK_CHUNK_SECONDS * 1000
             self.update_timer.start()
         except Exception as e:
             self.status_label.setText(f"Audio playback error: {e}")
@@ -184,8 +487,8 @@ class AudioTranscriber(QWidget):
     # --- Jump to sentence on click ---
     # --- Jump to sentence on click ---
     def jump_to_sentence(self, item):
-        idx = self.ja_list.currentRow()
-        if idx < 0 or idx >= len(self.segments):
+        idx = item.data(Qt.UserRole)
+        if idx is None or idx >= len(self.segments):
             return
 
         # Stop current playback first
@@ -204,10 +507,13 @@ class AudioTranscriber(QWidget):
 
     # --- Update selection according to playback ---
     def update_current_sentence(self):
-        if not self.play_obj or not self.audio_segment:
+        if not self.play_obj or not self.audio_path:
             return
         if self.play_obj.is_playing():
             self.current_playback_start += self.update_timer.interval()
+        elif self.chunk_end_ms < self.audio_duration_ms:
+            # Current chunk ran out, continue with the next one
+            self.play_audio(self.chunk_end_ms)
 
         current_sec = self.current_playback_start / 1000.0
 
@@ -216,11 +522,21 @@ class AudioTranscriber(QWidget):
             self.user_clicked_sentence = False
             return
 
-        for i, seg in enumerate(self.segments):
-            if seg['start'] <= current_sec <= seg['end']:
-                self.ja_list.setCurrentRow(i)
-                self.vi_list.setCurrentRow(i)
-                break
+        i = bisect.bisect_right(self.segment_starts, current_sec) - 1
+        if i >= 0 and current_sec <= self.segment_ends[i]:
+            self.ja_list.setCurrentRow(i)
+            self.vi_list.setCurrentRow(i)
+
+    # --- Workers ---
+    def start_worker(self, worker):
+        # Superseded workers may still be finishing; keep track of them all so
+        # none is destroyed while its thread is running
+        self.workers.add(worker)
+        worker.finished.connect(self.on_worker_finished)
+        worker.start()
+
+    def on_worker_finished(self):
+        self.workers.discard(self.sender())
 
     # --- Close event ---
     def closeEvent(self, event):
@@ -230,9 +546,13 @@ class AudioTranscriber(QWidget):
         )
         if reply == QMessageBox.Yes:
             self.stop_audio()
-            if self.worker and self.worker.isRunning():
-                self.worker.terminate()
-                self.worker.wait()
+            self.close_audio()
+            for worker in [self.model_worker, *self.workers]:
+                if worker.isRunning():
+                    worker.terminate()
+                    worker.wait()
+            if self.server_conn:
+                self.server_conn.close()
             event.accept()
         else:
             event.ignore()
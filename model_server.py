@@ -0,0 +1,303 @@
+import sys
+import os
+import time
+import threading
+import subprocess
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+import numpy as np
+import torch
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.transcribe import restore_speech_timestamps
+from faster_whisper.vad import VadOptions, collect_chunks, get_speech_timestamps
+from server_client import AUTHKEY_ENV, BATCH_SIZE, load_authkey, server_address, user_dir
+
+if os.name != 'nt':
+    import fcntl
+
+# The Whisper model lives in this long-running process so it is loaded once and
+# shared by every window and every later app launch. main.py talks to it through
+# the client helpers in server_client.py.
+
+# Shut down after this long without clients to give the VRAM back
+IDLE_TIMEOUT = 15 * 60
+
+# After a failed model load, longest wait for connected clients to get the error
+LOAD_ERROR_GRACE = 10
+
+# Pre-converted model written by export.py; the "small" download is used without it
+MODEL_DIR = os.environ.get(
+    "TRANSCRIBE_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "whisper-small")
+)
+
+# CTranslate2 runs on 4 CPU threads unless told otherwise; the batched VAD windows
+# can keep every core busy, so default to all physical cores on CPU-only machines
+# (0 = physical_cores())
+CPU_THREADS = int(os.environ.get("TRANSCRIBE_CPU_THREADS", 0))
+
+# Whisper input rate and window length
+SAMPLING_RATE = 16000
+CHUNK_SECONDS = 30
+
+# Number of decoded + VAD-trimmed files kept for re-transcription
+PREPARED_CACHE_SIZE = 4
+
+
+def available_cpus():
+    # CPUs this process may run on: its affinity mask (taskset, container cpuset),
+    # further capped by a cgroup v2 CPU quota (e.g. docker --cpus)
+    try:
+        allowed = os.sched_getaffinity(0)
+    except AttributeError:
+        allowed = set(range(os.cpu_count() or 1))
+    count = len(allowed)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            count = min(count, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return allowed, count
+
+
+def physical_cores():
+    # Hyper-threading siblings share one core's vector units, so GEMM threads on
+    # both mostly contend. Count the cores behind the usable CPUs where the OS
+    # reports them; elsewhere use every usable CPU rather than guess at SMT.
+    allowed, count = available_cpus()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cores = set()
+            processor = physical_id = None
+            for line in f:
+                key, _, value = line.partition(":")
+                key, value = key.strip(), value.strip()
+                if key == "processor":
+                    processor = int(value)
+                elif key == "physical id":
+                    physical_id = value
+                elif key == "core id" and processor in allowed:
+                    cores.add((physical_id, value))
+        if cores:
+            return min(len(cores), count)
+    except (OSError, ValueError):
+        pass
+    if sys.platform == "darwin":
+        try:
+            cores = int(subprocess.check_output(["sysctl", "-n", "hw.physicalcpu"]))
+            return min(cores, count)
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    return count
+
+
+def select_device():
+    # INT8 weights everywhere; half-precision activations only where the hardware
+    # has tensor cores for them (BF16 on Ampere+, FP16 on Volta/Turing, BF16 CPUs)
+    if torch.cuda.is_available():
+        device = "cuda"
+        major, _ = torch.cuda.get_device_capability()
+        if major >= 8:
+            preferred = ["int8_bfloat16", "int8_float16"]
+        elif major >= 7:
+            preferred = ["int8_float16"]
+        else:
+            preferred = []
+    else:
+        device = "cpu"
+        preferred = ["int8_bfloat16"]
+    supported = ctranslate2.get_supported_compute_types(device)
+    for compute_type in preferred + ["int8", "float32"]:
+        if compute_type in supported:
+            return device, compute_type
+    return device, "default"
+
+
+def detect_speech(audio):
+    # Silero VAD pre-pass: keep only speech, packed back to back into windows of at
+    # most CHUNK_SECONDS. Returns the packed waveform, the window bounds in it (s)
+    # and the original speech chunks needed to map timestamps back.
+    vad_options = VadOptions(max_speech_duration_s=CHUNK_SECONDS, min_silence_duration_ms=160)
+    speech_chunks = get_speech_timestamps(audio, vad_options, sampling_rate=SAMPLING_RATE)
+    if not speech_chunks:
+        return np.zeros(0, dtype=np.float32), [], []
+    audio_chunks, chunks_metadata = collect_chunks(
+        audio, speech_chunks, sampling_rate=SAMPLING_RATE, max_duration=CHUNK_SECONDS
+    )
+    clips = [
+        {'start': meta['offset'], 'end': meta['offset'] + meta['duration']}
+        for meta in chunks_metadata
+    ]
+    return np.concatenate(audio_chunks), clips, speech_chunks
+
+
+class ClientGone(Exception):
+    pass
+
+
+class ModelServer:
+    def __init__(self):
+        self.model = None
+        self.batched = None
+        self.load_error = None
+        self.ready = threading.Event()
+        self.model_lock = threading.Lock()
+        self.prepare_lock = threading.Lock()
+        self.prepared = {}  # (path, mtime) -> detect_speech result, oldest first
+        self.clients = 0
+        self.clients_lock = threading.Lock()
+        self.last_activity = time.monotonic()
+        self.closing = False
+
+    # --- Model ---
+    def load_model(self):
+        try:
+            device, compute_type = select_device()
+            model_path = MODEL_DIR if os.path.isdir(MODEL_DIR) else "small"
+            self.model = WhisperModel(
+                model_path, device=device, compute_type=compute_type,
+                cpu_threads=(CPU_THREADS or physical_cores()) if device == "cpu" else 0
+            )
+            self.batched = BatchedInferencePipeline(model=self.model)
+            # Warm up on 30 s of silence so CUDA/BLAS initialization and kernel
+            # selection happen here rather than on the first user transcription
+            silence = np.zeros(CHUNK_SECONDS * SAMPLING_RATE, dtype=np.float32)
+            segments, _ = self.model.transcribe(silence, language="ja", vad_filter=False)
+            list(segments)
+        except Exception as e:
+            traceback.print_exc()
+            self.load_error = str(e)
+        self.ready.set()
+
+    # --- Audio ---
+    def prepare(self, audio_path):
+        key = (audio_path, os.path.getmtime(audio_path))
+        # One decode at a time, so a transcribe racing the load-time prepare
+        # waits for it and then hits the cache
+        with self.prepare_lock:
+            if key not in self.prepared:
+                audio = decode_audio(audio_path, sampling_rate=SAMPLING_RATE)
+                self.prepared[key] = detect_speech(audio)
+                while len(self.prepared) > PREPARED_CACHE_SIZE:
+                    del self.prepared[next(iter(self.prepared))]
+            return self.prepared[key]
+
+    def transcribe(self, audio_path, options):
+        audio, clips, speech_chunks = self.prepare(audio_path)
+        if not clips:
+            return
+        # Remaining options (beam_size, temperature, ...) go straight to the decoder
+        options = dict(options)
+        batch_size = options.pop('batch_size', BATCH_SIZE)
+        with self.model_lock:
+            # VAD already ran in prepare(); silence never reaches the encoder
+            segments, _ = self.batched.transcribe(
+                audio, language="ja", batch_size=batch_size,
+                word_timestamps=True, clip_timestamps=clips, **options
+            )
+            # segments is a lazy generator; decoding happens while we iterate
+            for seg in restore_speech_timestamps(segments, speech_chunks, SAMPLING_RATE):
+                yield {'text': seg.text, 'start': seg.start, 'end': seg.end}
+
+    # --- Connections ---
+    def reply(self, conn, kind, payload=None):
+        try:
+            conn.send((kind, payload))
+        except OSError as e:
+            raise ClientGone() from e
+
+    def handle(self, conn):
+        try:
+            self.ready.wait()
+            while True:
+                command, *args = conn.recv()
+                self.last_activity = time.monotonic()
+                try:
+                    if self.load_error:
+                        raise RuntimeError(f"Error loading model: {self.load_error}")
+                    if command == "hello":
+                        self.reply(conn, "ready")
+                    elif command == "prepare":
+                        self.prepare(*args)
+                        self.reply(conn, "done")
+                    elif command == "transcribe":
+                        for seg in self.transcribe(*args):
+                            self.reply(conn, "segment", seg)
+                        self.reply(conn, "done")
+                    else:
+                        raise ValueError(f"Unknown command: {command}")
+                except ClientGone:
+                    raise
+                except Exception as e:
+                    self.reply(conn, "error", str(e))
+        except (ClientGone, OSError, EOFError):
+            # Client went away (window closed or worker terminated)
+            pass
+        finally:
+            conn.close()
+            with self.clients_lock:
+                self.clients -= 1
+            self.last_activity = time.monotonic()
+
+    def accept_loop(self, listener):
+        while not self.closing:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError, EOFError):
+                # Wrong key, or the client went away during the handshake
+                continue
+            with self.clients_lock:
+                self.clients += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def lock_instance(self):
+        # One server per user. On Windows creating the first pipe instance already
+        # fails for a twin; elsewhere hold a lock file for the life of the process.
+        if os.name == 'nt':
+            return True
+        self.lock_file = open(os.path.join(user_dir("runtime"), "server.lock"), 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def serve(self):
+        address = server_address()
+        authkey = os.environ.get(AUTHKEY_ENV)
+        authkey = bytes.fromhex(authkey) if authkey else load_authkey()
+        if not self.lock_instance():
+            return
+        # Left behind if the last server was killed
+        if os.name != 'nt' and os.path.exists(address):
+            os.unlink(address)
+        # Bind before loading so a second launch connects instead of starting a twin
+        try:
+            listener = Listener(address, authkey=authkey)
+        except OSError:
+            traceback.print_exc()
+            return
+        threading.Thread(target=self.accept_loop, args=(listener,), daemon=True).start()
+        self.load_model()
+        if self.load_error:
+            # Nothing to serve: exit once the waiting clients have the error, so the
+            # next launch starts a fresh server that tries the load again
+            deadline = time.monotonic() + LOAD_ERROR_GRACE
+            while self.clients and time.monotonic() < deadline:
+                time.sleep(0.2)
+        else:
+            while self.clients or time.monotonic() - self.last_activity < IDLE_TIMEOUT:
+                time.sleep(10)
+        self.closing = True
+        listener.close()
+        if self.load_error:
+            # Lets a client that started this server report the log instead of waiting
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    ModelServer().serve()
@@ -0,0 +1,156 @@
+import sys
+import os
+import time
+import secrets
+import getpass
+import subprocess
+from multiprocessing.connection import Client, answer_challenge, deliver_challenge
+
+# Client side of model_server.py. Only stdlib imports, so the GUI can talk to the
+# model process without loading torch or faster-whisper itself.
+
+APP_NAME = "japanese-audio-transcriber"
+
+# Key handed to a server this process starts; see load_authkey()
+AUTHKEY_ENV = "TRANSCRIBE_SERVER_AUTHKEY"
+
+# Number of VAD chunks decoded together; lower to 4-8 on low-VRAM GPUs
+BATCH_SIZE = int(os.environ.get("TRANSCRIBE_BATCH_SIZE", 16))
+
+# Longest wait for a running server to start the authentication handshake
+HANDSHAKE_TIMEOUT = 10
+
+MODEL_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_server.py")
+
+
+def user_dir(kind):
+    # Per-user "config", "cache" or "runtime" directory for this app, kept private
+    if os.name == 'nt':
+        base = os.environ.get("APPDATA" if kind == "config" else "LOCALAPPDATA")
+    elif kind == "config":
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    elif kind == "runtime":
+        base = os.environ.get("XDG_RUNTIME_DIR")
+    else:
+        base = None
+    if not base:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.name != 'nt':
+        os.chmod(path, 0o700)
+    return path
+
+
+def log_path():
+    return os.path.join(user_dir("cache"), "server.log")
+
+
+def server_address():
+    # A socket in a user-private directory (a per-user pipe on Windows), so other
+    # users can neither connect to the server nor stand in for it
+    if os.name == 'nt':
+        return rf'\\.\pipe\{APP_NAME}-{getpass.getuser()}'
+    return os.path.join(user_dir("runtime"), "server.sock")
+
+
+def load_authkey():
+    # Random per-user secret for the HMAC handshake, which both sides run before
+    # any pickled message is read; created once, readable by this user only
+    path = os.path.join(user_dir("config"), "authkey")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        if os.name != 'nt':
+            os.chmod(path, 0o600)
+        # Another launch may have created it a moment ago and still be writing
+        for _ in range(50):
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return bytes.fromhex(key)
+            time.sleep(0.02)
+        raise RuntimeError(f"Empty server key file: {path}")
+    key = secrets.token_bytes(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key.hex())
+    return key
+
+
+def start_server(authkey):
+    kwargs = {}
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    # Detached so it outlives this app launch and serves the next one; its output
+    # goes to a log so a crash can be diagnosed
+    with open(log_path(), 'ab') as log:
+        return subprocess.Popen(
+            [sys.executable, MODEL_SERVER_SCRIPT],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            env=dict(os.environ, **{AUTHKEY_ENV: authkey.hex()}),
+            **kwargs
+        )
+
+
+def open_connection(address, authkey):
+    # Client(address, authkey=...) waits for the server's challenge without a timeout,
+    # so run the same handshake by hand and give up on a server that never starts it
+    conn = Client(address)
+    try:
+        if not conn.poll(HANDSHAKE_TIMEOUT):
+            raise RuntimeError(f"Model server is not responding, see {log_path()}")
+        answer_challenge(conn, authkey)
+        deliver_challenge(conn, authkey)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def connect(timeout=60):
+    # Connect to the running server, starting one first if there is none
+    address, authkey = server_address(), load_authkey()
+    try:
+        return open_connection(address, authkey)
+    except (FileNotFoundError, ConnectionRefusedError):
+        process = start_server(authkey)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return open_connection(address, authkey)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Exit code 0 means another launch's server won the race; keep waiting for it
+            if process.poll():
+                raise RuntimeError(
+                    f"Model server exited with code {process.returncode}, see {log_path()}"
+                )
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"Model server did not start within {timeout} s, see {log_path()}"
+                )
+            time.sleep(0.2)
+
+
+class Cancelled(Exception):
+    pass
+
+
+def request(conn, *message, cancelled=None):
+    # Send one command and yield its streamed replies until "done". While waiting,
+    # cancelled() is polled and Cancelled raised once it returns true; the caller
+    # then closes the connection, which makes the server drop the command.
+    conn.send(message)
+    while True:
+        while cancelled is not None:
+            if cancelled():
+                raise Cancelled()
+            if conn.poll(0.2):
+                break
+        kind, payload = conn.recv()
+        if kind == "error":
+            raise RuntimeError(payload)
+        if kind in ("done", "ready"):
+            return
+        yield payload